@@ -1,159 +1,568 @@
+import fcntl
 import os
+import sys
 import time
+import errno
+import mmap
+import ctypes
+import ctypes.util
+import select
+import selectors
+import signal
+import socket
+import struct
 import subprocess
-from datetime import datetime
-from multiprocessing import Process, Event, Manager
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import Process, Event
 import shutil
 
 # ---------------- Configuration ----------------
 OUTPUT_DIR = "/captures"
-TEMP_DIR = "/captures/tmp"
-CAP_DURATION = 60       # TShark capture duration in seconds
+TEMP_DIR = "/captures/tmp"     # on the /captures volume unless a tmpfs is mounted here (see README)
+CAP_DURATION = 60       # seconds per dumpcap ring buffer file
+CAPTURE_BUFFER_MB = 256 # kernel capture buffer size (dumpcap -B)
+RESTART_DELAY = 2       # seconds before restarting dumpcap if it exits
+CAP_SLACK = 5           # seconds packet times may stray outside a ring file's nominal span
 WAIT_AFTER_FINISH = 2   # seconds before merging
 MERGE_RETRIES = 5
 MERGE_DELAY = 2
+PROCESSED_CAPACITY = 4096  # max temp file inodes remembered by supervisor_loop
+MERGE_FAILURE_LIMIT = 3    # failed merge passes before a temp file is moved to TEMP_DIR/bad
+MERGE_RETRY_INTERVAL = 60  # seconds before a temp file whose merge failed is tried again
+CONTROL_SOCKET = "/tmp/supervisor.ctl"  # UNIX socket accepting a STOP command
 stop_event = Event()
+capture_done = Event()  # set by main once the capture process has exited
+
+# Absolute dumpcap path, resolved once: its Popen only takes subprocess's
+# posix_spawn fast path (no fork of this interpreter) when the executable has a directory.
+DUMPCAP = shutil.which("dumpcap") or "dumpcap"
 
 # Ensure directories exist
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(TEMP_DIR, exist_ok=True)
 
-# ---------------- TShark Process ----------------
-def run_tshark(stop_event, last_temp_holder):
-    """Continuously run TShark every CAP_DURATION seconds."""
-    while not stop_event.is_set():
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        temp_file = os.path.join(TEMP_DIR, f"cap_temp_{timestamp}.pcapng")
-        last_temp_holder['file'] = temp_file  # Store last temp file
-        cmd = ["tshark", "-i", "any", "-a", f"duration:{CAP_DURATION}", "-w", temp_file]
-        proc = subprocess.Popen(cmd)
-        while proc.poll() is None and not stop_event.is_set():
-            time.sleep(0.1)
-        if proc.poll() is None:
-            proc.terminate()
-            proc.wait()
-        print(f"[TShark] Finished {temp_file}")
+# ---------------- Capture Process ----------------
+def drain_fd(fd):
+    """Read and discard everything currently buffered on a non-blocking fd."""
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+def signal_wakeup_fd():
+    """Route signal wakeups into a new non-blocking pipe and return its read end."""
+    wake_r, wake_w = os.pipe()
+    os.set_blocking(wake_r, False)
+    os.set_blocking(wake_w, False)
+    signal.set_wakeup_fd(wake_w)
+    return wake_r
+
+def run_dumpcap(stop_event):
+    """Run dumpcap with a CAP_DURATION-second ring buffer in TEMP_DIR, restarting it if it exits."""
+    ring_file = os.path.join(TEMP_DIR, "cap_temp.pcapng")
+    cmd = [
+        DUMPCAP, "-i", "any", "-n", "-B", str(CAPTURE_BUFFER_MB),
+        "-b", f"duration:{CAP_DURATION}", "-w", ring_file
+    ]
+    # SIGCHLD (dumpcap exited) and SIGTERM/SIGINT (stop requested by main or
+    # Ctrl-C) are delivered through the signal wakeup fd, so the loop blocks until one arrives.
+    wake_r = signal_wakeup_fd()
+    signal.signal(signal.SIGCHLD, lambda *_: None)
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    with selectors.DefaultSelector() as selector:
+        selector.register(wake_r, selectors.EVENT_READ)
+        while not stop_event.is_set():
+            # close_fds=False keeps posix_spawn eligible; our own fds are non-inheritable anyway
+            proc = subprocess.Popen(cmd, close_fds=False)
+            while proc.poll() is None and not stop_event.is_set():
+                selector.select()
+                drain_fd(wake_r)
+            if proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+            print(f"[Dumpcap] Exited with code {proc.returncode}")
+            if not stop_event.is_set():
+                selector.select(RESTART_DELAY)
+                drain_fd(wake_r)
 
 # ---------------- Supervisor Utilities ----------------
 def get_first_last_time(pcap_file):
-    """Return first and last frame timestamps as datetime objects."""
-    try:
-        frames = subprocess.check_output(
-            ["tshark", "-r", pcap_file, "-T", "fields", "-e", "frame.time_epoch"],
-            text=True
-        ).strip().splitlines()
-        if not frames:
-            return None, None
-        first_time = datetime.fromtimestamp(float(frames[0]))
-        last_time = datetime.fromtimestamp(float(frames[-1]))
-        return first_time, last_time
-    except Exception as e:
-        print(f"[WARN] Failed to get frame times: {e}")
+    """Return first and last frame timestamps as datetime objects, or (None, None) for a capture without packets.
+
+    Raises if capinfos fails or its output cannot be read, so the caller keeps the file.
+    """
+    output = subprocess.check_output(
+        ["capinfos", "-aeS", "-M", pcap_file],
+        text=True
+    )
+    first_time = last_time = None
+    for line in output.splitlines():
+        key, _, value = line.partition(":")
+        # Wireshark 4.x labels these "Earliest/Latest packet time"
+        if key in ("First packet time", "Earliest packet time"):
+            first_time = value.strip()
+        elif key in ("Last packet time", "Latest packet time"):
+            last_time = value.strip()
+    # capinfos reports "n/a" for captures without packets
+    if first_time == "n/a" or last_time == "n/a":
         return None, None
+    if first_time is None or last_time is None:
+        raise ValueError(f"no packet times in capinfos output for {pcap_file}")
+    return datetime.fromtimestamp(float(first_time)), datetime.fromtimestamp(float(last_time))
 
-def safe_merge(hour_file, temp_file, retries=MERGE_RETRIES, delay=MERGE_DELAY, initial_wait=WAIT_AFTER_FINISH):
-    """Merge temp_file into hour_file with retry mechanism and initial wait."""
-    time.sleep(initial_wait)  # initial wait only once
+PCAPNG_SHB_TYPE = b"\x0a\x0d\x0d\x0a"
+PCAPNG_BYTE_ORDER_MAGICS = (b"\x1a\x2b\x3c\x4d", b"\x4d\x3c\x2b\x1a")
+PCAPNG_MIN_PACKET_FILE = 80  # SHB (28) + IDB (20) + EPB (32) bytes: anything smaller holds no packet
+
+def pcapng_byte_order(pcap_file):
+    """Return the byte-order magic of a pcapng file, or None if it is not pcapng."""
+    with open(pcap_file, "rb") as f:
+        header = f.read(12)
+    if header[:4] != PCAPNG_SHB_TYPE or header[8:12] not in PCAPNG_BYTE_ORDER_MAGICS:
+        return None
+    return header[8:12]
+
+APPEND_CHUNK = 1 << 20
+# One page-aligned buffer reused by the userspace fallback, so copying allocates nothing per chunk
+append_buffer = memoryview(mmap.mmap(-1, APPEND_CHUNK))
+# errnos meaning "this kind of kernel copy is not possible here", not "the copy failed"
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+def _kernel_copies():
+    """Yield the available in-kernel copy functions, fastest first."""
+    if hasattr(os, "copy_file_range"):
+        yield lambda src_fd, dst_fd, count: os.copy_file_range(src_fd, dst_fd, count)
+    if hasattr(os, "sendfile"):
+        yield lambda src_fd, dst_fd, count: os.sendfile(dst_fd, src_fd, None, count)
+
+def _fast_append(src_fd, dst_fd, count):
+    """Copy count bytes from src_fd to dst_fd at their current offsets, in the kernel where possible.
+
+    Tries copy_file_range (may reflink on XFS/Btrfs), then sendfile, then a read/write loop.
+    All three advance both file offsets, so a fallback resumes where the previous one stopped;
+    a method that stops short (returns 0 early) hands over to the next one as well.
+    """
+    for kernel_copy in _kernel_copies():
+        try:
+            while count > 0:
+                n = kernel_copy(src_fd, dst_fd, min(count, 1 << 30))
+                if n == 0:
+                    break
+                count -= n
+        except OSError as e:
+            if e.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+        if count == 0:
+            return
+    while count > 0:
+        n = os.readv(src_fd, [append_buffer])
+        if n == 0:
+            break
+        view = append_buffer[:n]
+        while view:
+            view = view[os.write(dst_fd, view):]
+        count -= n
+    if count > 0:
+        raise OSError(errno.EIO, f"short copy: {count} bytes missing")
+
+def append_pcapng(hour_file, temp_file):
+    """Append temp_file to hour_file as a new pcapng section, truncating back on failure."""
+    # Not O_APPEND: copy_file_range and sendfile reject append-mode destinations
+    dst_fd = os.open(hour_file, os.O_WRONLY | os.O_CLOEXEC)
+    try:
+        size = os.lseek(dst_fd, 0, os.SEEK_END)
+        with open(temp_file, "rb", buffering=0) as src:
+            try:
+                _fast_append(src.fileno(), dst_fd, os.fstat(src.fileno()).st_size)
+            except OSError:
+                os.ftruncate(dst_fd, size)
+                raise
+    finally:
+        os.close(dst_fd)
+
+def _merge_one(hour_file, temp_file, retries, delay):
+    """Merge a single temp_file into hour_file, retrying on failure; return True on success."""
     for attempt in range(retries):
         try:
-            subprocess.run(["mergecap", "-w", hour_file, hour_file, temp_file], check=True)
-            print(f"[Supervisor] Merged {temp_file} → {hour_file}")
-            os.remove(temp_file)
-            return True
-        except subprocess.CalledProcessError:
+            byte_order = pcapng_byte_order(temp_file)
+            if byte_order is not None and byte_order == pcapng_byte_order(hour_file):
+                append_pcapng(hour_file, temp_file)
+            else:
+                new_file = hour_file + ".new"
+                subprocess.run(["mergecap", "-w", new_file, hour_file, temp_file], check=True)
+                os.replace(new_file, hour_file)
+            break
+        except (subprocess.CalledProcessError, OSError):
             print(f"[WARN] Merge failed for {temp_file}, retrying in {delay}s ({attempt+1}/{retries})")
             time.sleep(delay)
-    print(f"[ERROR] Could not merge {temp_file} after {retries} attempts.")
-    return False
+    else:
+        print(f"[ERROR] Could not merge {temp_file} after {retries} attempts.")
+        return False
+    os.remove(temp_file)
+    print(f"[Supervisor] Merged {temp_file} → {hour_file}")
+    return True
+
+def quarantine(temp_file):
+    """Move a temp file that cannot be merged to TEMP_DIR/bad, out of the supervisor's way."""
+    bad_dir = os.path.join(TEMP_DIR, "bad")
+    os.makedirs(bad_dir, exist_ok=True)
+    dest = os.path.join(bad_dir, os.path.basename(temp_file))
+    os.replace(temp_file, dest)
+    print(f"[ERROR] Moved {temp_file} to {dest}")
+
+def safe_merge(hour_file, temp_files, retries=MERGE_RETRIES, delay=MERGE_DELAY, initial_wait=WAIT_AFTER_FINISH):
+    """Merge temp_files, in order, into hour_file, with retry mechanism and one initial wait.
+
+    pcapng files are sequences of self-contained sections, so each file with the same
+    byte order as hour_file is merged by appending; any other file goes through
+    mergecap on its own. A file that still fails after every retry is moved to
+    TEMP_DIR/bad so the rest of the hour is merged. Returns True if every file was merged.
+    """
+    time.sleep(initial_wait)  # initial wait only once
+    merged_all = True
+    with open(hour_file, "ab") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # one writer per hour file
+        for temp_file in temp_files:
+            if not _merge_one(hour_file, temp_file, retries, delay):
+                quarantine(temp_file)
+                merged_all = False
+    return merged_all
+
+def temp_file_start(temp_file):
+    """Return the start time dumpcap put in a ring file name, or None if there is none."""
+    stamp = os.path.splitext(os.path.basename(temp_file))[0].rsplit("_", 1)[-1]
+    try:
+        return datetime.strptime(stamp, "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+
+def pcapng_complete(pcap_file):
+    """Return True if pcap_file is pcapng, large enough to hold a packet and ends on a whole block."""
+    byte_order = pcapng_byte_order(pcap_file)
+    if byte_order is None:
+        return False
+    fmt = "<I" if byte_order == b"\x4d\x3c\x2b\x1a" else ">I"
+    with open(pcap_file, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size < PCAPNG_MIN_PACKET_FILE:
+            return False
+        # Every block repeats its total length at its end, so the last block can be found from the tail
+        f.seek(size - 4)
+        (length,) = struct.unpack(fmt, f.read(4))
+        if length < 12 or length % 4 or length > size:
+            return False
+        f.seek(size - length + 4)
+        return struct.unpack(fmt, f.read(4))[0] == length
+
+def hour_fragments(temp_file):
+    """Return (file, hour_key) pairs for a finished temp file, splitting it across hours if needed.
+
+    Raises if the temp file cannot be probed or split; the file is then left in place.
+    """
+    # Ring files last CAP_DURATION seconds, so the name alone settles the hour
+    # unless the file may straddle one; only then are packet times read. A file
+    # that is empty or cut short is always probed, so it is never merged unchecked.
+    start = temp_file_start(temp_file)
+    if start is not None and pcapng_complete(temp_file):
+        hour_start = (start - timedelta(seconds=CAP_SLACK)).replace(minute=0, second=0, microsecond=0)
+        end = start + timedelta(seconds=CAP_DURATION + CAP_SLACK)
+        if hour_start == end.replace(minute=0, second=0, microsecond=0):
+            return [(temp_file, hour_start.strftime("%Y%m%d_%H"))]
 
-def merge_temp_file(temp_file):
-    """Merge a finished temp file into hourly files, splitting across hours if needed."""
     first_time, last_time = get_first_last_time(temp_file)
     if first_time is None:
         os.remove(temp_file)
-        return
-
-    # Check if temp file spans multiple hours
-    if first_time.hour != last_time.hour or first_time.date() != last_time.date():
-        split_dir = os.path.join(TEMP_DIR, "split")
-        os.makedirs(split_dir, exist_ok=True)
-        subprocess.run([
-            "editcap", "-F", "pcapng", "-i", "3600", temp_file,
-            os.path.join(split_dir, "split.pcapng")
-        ], check=True)
-        os.remove(temp_file)
-        for f in sorted(os.listdir(split_dir)):
-            merge_temp_file(os.path.join(split_dir, f))
-        shutil.rmtree(split_dir)
-        return
+        return []
+
+    hour_start = first_time.replace(minute=0, second=0, microsecond=0)
+    last_hour_start = last_time.replace(minute=0, second=0, microsecond=0)
+    if hour_start == last_hour_start:
+        return [(temp_file, hour_start.strftime("%Y%m%d_%H"))]
 
-    # Merge into correct hour file
-    hour_key = first_time.strftime("%Y%m%d_%H")
+    # Temp file spans multiple hours: cut out each hour with editcap -A/-B.
+    # Fragments go into TEMP_DIR itself, with the source name (and so its start
+    # time) as the tail of their own, so one whose merge fails is picked up and
+    # retried by a later scan in its original order.
+    name = os.path.splitext(os.path.basename(temp_file))[0]
+    fragments = []
+    try:
+        while hour_start <= last_hour_start:
+            hour_end = hour_start + timedelta(hours=1)
+            hour_key = hour_start.strftime("%Y%m%d_%H")
+            fragment = os.path.join(TEMP_DIR, f"cap_split_{hour_start:%Y%m%d%H}_{name}.pcapng")
+            fragments.append((fragment, hour_key))
+            subprocess.run([
+                "editcap", "-F", "pcapng",
+                "-A", hour_start.strftime("%Y-%m-%d %H:%M:%S"),
+                "-B", hour_end.strftime("%Y-%m-%d %H:%M:%S"),
+                temp_file, fragment
+            ], check=True)
+            hour_start = hour_end
+    except (subprocess.CalledProcessError, OSError):
+        # Leave only the intact source behind; it is split again on a later pass
+        for fragment, _ in fragments:
+            if os.path.exists(fragment):
+                os.remove(fragment)
+        raise
+    os.remove(temp_file)
+    return fragments
+
+def _merge_into_hour(hour_key, temp_files):
+    """Merge temp_files, in order, into the hourly file for hour_key. Returns True on success."""
     hour_file = os.path.join(OUTPUT_DIR, f"cap_{hour_key}.pcapng")
-    if os.path.exists(hour_file):
-        safe_merge(hour_file, temp_file)
-    else:
-        os.rename(temp_file, hour_file)
+    if not os.path.exists(hour_file):
+        # TEMP_DIR may be a tmpfs, in which case this is a copy rather than a rename
+        try:
+            shutil.move(temp_files[0], hour_file)
+        except OSError:
+            # A copy that failed part-way must not become the start of the hour file
+            if os.path.exists(temp_files[0]) and os.path.exists(hour_file):
+                os.remove(hour_file)
+            raise
         print(f"[Supervisor] Created new hour file {hour_file}")
+        temp_files = temp_files[1:]
+    if temp_files:
+        return safe_merge(hour_file, temp_files)
+    return True
+
+def _merge_hour_group(hour_key, temp_files):
+    """Run _merge_into_hour, reporting any exception instead of raising it. Returns True on success."""
+    try:
+        return _merge_into_hour(hour_key, temp_files)
+    except Exception as e:
+        print(f"[ERROR] Merge into hour {hour_key} failed: {e}")
+        return False
+
+def merge_temp_files(temp_files):
+    """Merge finished temp files into hourly files, one merge per target hour.
+
+    Different hours write disjoint files, so a backlog spanning several hours is
+    merged in parallel. Returns the temp files that were merged completely; the
+    rest, including fragments of split files, stay in TEMP_DIR for a later pass.
+    """
+    groups = {}
+    sources = {}
+    failed = set()
+    for temp_file in temp_files:
+        try:
+            fragments = hour_fragments(temp_file)
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            print(f"[ERROR] Could not prepare {temp_file} for merging, keeping it: {e}")
+            failed.add(temp_file)
+            continue
+        for fragment, hour_key in fragments:
+            groups.setdefault(hour_key, []).append(fragment)
+            sources.setdefault(hour_key, set()).add(temp_file)
+
+    if len(groups) > 1:
+        # Workers ignore Ctrl-C; the supervisor decides when merging stops
+        with ProcessPoolExecutor(max_workers=min(len(groups), os.cpu_count() or 1),
+                                 initializer=signal.signal, initargs=(signal.SIGINT, signal.SIG_IGN)) as pool:
+            results = dict(zip(groups, pool.map(_merge_hour_group, groups, groups.values())))
+    else:
+        results = {hour_key: _merge_hour_group(hour_key, fragments) for hour_key, fragments in groups.items()}
+
+    for hour_key, merged in results.items():
+        if not merged:
+            failed |= sources[hour_key]
+    return [f for f in temp_files if f not in failed]
+
+# ---------------- Directory Watch ----------------
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+def open_watch(path):
+    """Return an inotify fd watching path for new/finished files, or None if inotify is unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        inotify_init1 = libc.inotify_init1
+        inotify_add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        err = ctypes.get_errno()
+        if err == errno.ENOSYS:
+            return None
+        raise OSError(err, os.strerror(err))
+    # IN_CREATE wakes us when dumpcap starts the next file, i.e. when the previous one is complete
+    if inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE) < 0:
+        err = ctypes.get_errno()
+        os.close(fd)
+        raise OSError(err, os.strerror(err))
+    return fd
+
+def wait_for_changes(fds, timeout):
+    """Block until one of fds is readable or timeout (None: forever) expires, draining what is ready."""
+    ready, _, _ = select.select(fds, [], [], timeout)
+    for fd in ready:
+        drain_fd(fd)
 
 # ---------------- Supervisor Loop ----------------
-def supervisor_loop(stop_event, last_temp_holder, tshark_proc):
+def temp_file_sort_key(name):
+    """Order dumpcap ring files (cap_temp_NNNNN_YYYYmmddHHMMSS.pcapng) by start time.
+
+    The sequence number restarts whenever dumpcap does, so it only breaks ties.
+    """
+    return os.path.splitext(name)[0].rsplit("_", 1)[-1], name
+
+def remember_processed(processed, inodes):
+    """Add inodes to the insertion-ordered processed dict, evicting the oldest beyond PROCESSED_CAPACITY."""
+    for inode in inodes:
+        processed.pop(inode, None)
+        processed[inode] = None
+    while len(processed) > PROCESSED_CAPACITY:
+        del processed[next(iter(processed))]
+
+def count_failures(failures, entries):
+    """Count a failed merge pass for each entry still in TEMP_DIR, moving it to TEMP_DIR/bad at MERGE_FAILURE_LIMIT."""
+    for e in entries:
+        if not os.path.exists(e.path):  # split into fragments, or already moved aside
+            continue
+        count = failures.get(e.inode(), (0, 0))[0] + 1
+        if count < MERGE_FAILURE_LIMIT:
+            failures[e.inode()] = (count, time.monotonic() + MERGE_RETRY_INTERVAL)
+            continue
+        try:
+            quarantine(e.path)
+            failures.pop(e.inode(), None)
+        except OSError as err:
+            print(f"[ERROR] Could not move {e.path} aside: {err}")
+
+def supervisor_loop(stop_event, capture_done):
     """Monitor TEMP_DIR and merge completed temp files safely."""
-    processed = set()
+    processed = {}  # inodes of temp files already handed to merge_temp_files, oldest first
+    failures = {}   # inode -> (failed merge passes, monotonic time of the next attempt)
+    # Ctrl-C or SIGTERM asks for a stop; the final merge pass still runs once dumpcap is done
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    watch_fd = open_watch(TEMP_DIR)
+    # main sends SIGTERM once dumpcap is done, and the handler above runs through
+    # the wakeup fd, so no timer is needed to notice shutdown
+    wake_fd = signal_wakeup_fd()
+    files = []
+    dir_mtime = None  # TEMP_DIR mtime when files was scanned; creating or removing a file bumps it
     while True:
-        files = sorted(f for f in os.listdir(TEMP_DIR) if f.endswith(".pcapng"))
+        # Checked before scanning: once dumpcap has exited, this scan sees every file it wrote
+        finished = stop_event.is_set() and capture_done.is_set()
+        mtime = os.stat(TEMP_DIR).st_mtime_ns
+        if mtime != dir_mtime or finished:
+            dir_mtime = mtime
+            with os.scandir(TEMP_DIR) as it:
+                files = sorted(
+                    (e for e in it if e.name.endswith(".pcapng") and e.is_file(follow_symlinks=False)),
+                    key=lambda e: temp_file_sort_key(e.name)
+                )
+            # Forget inodes of files that are gone so a reused inode is not mistaken for a processed file
+            present = {e.inode() for e in files}
+            for inode in [i for i in processed if i not in present]:
+                del processed[inode]
+            for inode in [i for i in failures if i not in present]:
+                del failures[inode]
 
-        # Merge all but the last file
-        if len(files) >= 2:
-            time.sleep(WAIT_AFTER_FINISH)
-            for f in files[:-1]:
-                temp_file = os.path.join(TEMP_DIR, f)
-                if temp_file not in processed:
-                    merge_temp_file(temp_file)
-                    processed.add(temp_file)
-
-        # Exit condition: stop_event set AND TShark finished
-        if stop_event.is_set() and (tshark_proc is None or not tshark_proc.is_alive()):
+        # Exit condition: stop_event set AND dumpcap finished
+        if finished:
             # Merge remaining files
-            for f in files:
-                temp_file = os.path.join(TEMP_DIR, f)
-                if temp_file not in processed:
-                    merge_temp_file(temp_file)
-                    processed.add(temp_file)
+            pending = [e for e in files if e.inode() not in processed]
+            if pending:
+                merged = set(merge_temp_files([e.path for e in pending]))
+                remember_processed(processed, (e.inode() for e in pending if e.path in merged))
             break
 
-        if len(files) < 2:
-            time.sleep(10)
+        # Merge all but the last file
+        if len(files) >= 2:
+            pending = [
+                e for e in files[:-1]
+                if e.inode() not in processed and failures.get(e.inode(), (0, 0))[1] <= time.monotonic()
+            ]
+            if pending:
+                time.sleep(WAIT_AFTER_FINISH)
+                merged = set(merge_temp_files([e.path for e in pending]))
+                remember_processed(processed, (e.inode() for e in pending if e.path in merged))
+                count_failures(failures, [e for e in pending if e.path not in merged])
+
+        if watch_fd is not None:
+            wait_for_changes([watch_fd, wake_fd], None)
         else:
-            time.sleep(0.1)
+            wait_for_changes([wake_fd], 10 if len(files) < 2 else 0.1)
 
 # ---------------- Main ----------------
-def main():
-    with Manager() as manager:
-        last_temp_holder = manager.dict()  # track last temp file
-
-        tshark_proc = Process(target=run_tshark, args=(stop_event, last_temp_holder))
-        sup_proc = Process(target=supervisor_loop, args=(stop_event, last_temp_holder, tshark_proc))
+def request_stop(*_):
+    """Signal handler: ask every process to shut down."""
+    stop_event.set()
 
-        tshark_proc.start()
-        sup_proc.start()
-
-        try:
-            while True:
-                cmd = input("Type STOP to terminate: ").strip().upper()
+def wait_for_stop():
+    """Block until SIGTERM/SIGINT, STOP on CONTROL_SOCKET, or STOP typed on a TTY sets stop_event."""
+    wake_r = signal_wakeup_fd()
+    if os.path.exists(CONTROL_SOCKET):
+        os.remove(CONTROL_SOCKET)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server, selectors.DefaultSelector() as selector:
+        server.bind(CONTROL_SOCKET)
+        server.listen()
+        selector.register(server, selectors.EVENT_READ)
+        selector.register(wake_r, selectors.EVENT_READ)
+        if sys.stdin.isatty():
+            print("Type STOP to terminate: ", end="", flush=True)
+            selector.register(sys.stdin, selectors.EVENT_READ)
+        while not stop_event.is_set():
+            for key, _ in selector.select():
+                if key.fileobj is server:
+                    conn, _ = server.accept()
+                    with conn:
+                        conn.settimeout(1)
+                        try:
+                            cmd = conn.recv(64).decode(errors="replace").strip().upper()
+                        except OSError:
+                            cmd = ""
+                elif key.fileobj is sys.stdin:
+                    line = sys.stdin.readline()
+                    if not line:
+                        selector.unregister(sys.stdin)  # EOF: stop watching the terminal
+                    cmd = line.strip().upper()
+                else:
+                    drain_fd(wake_r)
+                    continue
                 if cmd == "STOP":
                     print("[Main] STOP received")
                     stop_event.set()
-                    break
-        except KeyboardInterrupt:
-            stop_event.set()
+    os.remove(CONTROL_SOCKET)
+
+def send_stop():
+    """Send STOP to a running supervisor through CONTROL_SOCKET."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(CONTROL_SOCKET)
+        client.sendall(b"STOP\n")
+
+def main():
+    # These cover main only. Ctrl-C reaches the whole process group, so
+    # run_dumpcap and supervisor_loop install their own on the stop_event they get.
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
 
-        print("[Main] Waiting for TShark to finish current capture...")
-        tshark_proc.join()
-        print("[Main] TShark exited. Waiting for supervisor to merge last file...")
-        sup_proc.join()
+    capture_proc = Process(target=run_dumpcap, args=(stop_event,))
+    sup_proc = Process(target=supervisor_loop, args=(stop_event, capture_done))
 
-        print("[Main] Exited gracefully.")
+    capture_proc.start()
+    sup_proc.start()
+
+    wait_for_stop()
+    capture_proc.terminate()  # SIGTERM wakes run_dumpcap, which then stops dumpcap cleanly
+
+    print("[Main] Waiting for dumpcap to finish current capture...")
+    capture_proc.join()
+    capture_done.set()
+    sup_proc.terminate()  # SIGTERM wakes supervisor_loop for its final merge pass
+    print("[Main] Dumpcap exited. Waiting for supervisor to merge last file...")
+    sup_proc.join()
+
+    print("[Main] Exited gracefully.")
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["stop"]:
+        send_stop()
+    else:
+        main()